@@ -7,19 +7,51 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD'),
     'database': os.getenv('DB_NAME', 'telegramdb')
 }
-# Connect to your RDS database
-conn = psycopg2.connect(DB_CONFIG)
-print("connected")
-
-cursor = conn.cursor()
-# Verify the table was created
-cursor.execute("""
-    SELECT * from payments
-""")
-
-columns = cursor.fetchall()
-print(columns)
-
-cursor.close()
-conn.close()
-print("Database connection closed.")
\ No newline at end of file
+
+
+def create_payments_index(conn):
+    """Create the (user_id, date DESC) index used by /payments, rebuilding it if a previous build left it invalid."""
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    cursor = conn.cursor()
+
+    # A failed or cancelled concurrent build leaves an INVALID index that IF NOT EXISTS would skip
+    cursor.execute("""
+        SELECT indisvalid
+        FROM pg_index
+        WHERE indexrelid = to_regclass('payments_user_date_idx')
+    """)
+    row = cursor.fetchone()
+    if row is not None and not row[0]:
+        print("Dropping invalid index payments_user_date_idx")
+        cursor.execute("DROP INDEX CONCURRENTLY payments_user_date_idx")
+
+    cursor.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS payments_user_date_idx
+        ON payments (user_id, date DESC)
+    """)
+    print("Index payments_user_date_idx is ready")
+
+    cursor.close()
+    conn.autocommit = False
+
+
+if __name__ == '__main__':
+    # Connect to your RDS database
+    conn = psycopg2.connect(**DB_CONFIG)
+    print("connected")
+
+    create_payments_index(conn)
+
+    cursor = conn.cursor()
+    # Verify the table was created
+    cursor.execute("""
+        SELECT id, user_id, company, date, price FROM payments LIMIT 5
+    """)
+
+    columns = cursor.fetchall()
+    print(columns)
+
+    cursor.close()
+    conn.close()
+    print("Database connection closed.")
@@ -4,9 +4,31 @@ import json
 import pytesseract
 from PIL import Image
 import openai
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+import asyncio
 import base64
-from openai import OpenAI
+import hashlib
+import importlib.util
+import io
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+from operator import itemgetter
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# Parallelism comes from the engine pool below; keep tesseract's OpenMP from oversubscribing cores
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+try:
+    from tesserocr import PyTessBaseAPI, PSM, OEM
+except ImportError:
+    PyTessBaseAPI = None
 
 
 # Configure Tesseract path for Windows
@@ -16,19 +38,261 @@ pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tessera
 api_key = os.getenv('OPENAI_API_KEY')
 if not api_key:
     raise ValueError("OPENAI_API_KEY not found in environment variables")
-client = OpenAI(api_key=api_key)
+# Reuse keep-alive connections to the API; HTTP/2 is used when the optional h2 package is installed.
+# Idle connections are kept for minutes rather than httpx's default 5 seconds, so the connection
+# opened at startup (and between receipts on a quiet bot) is still there for the next request.
+OPENAI_KEEPALIVE_EXPIRY = 300.0
+client = AsyncOpenAI(
+    api_key=api_key,
+    http_client=DefaultAsyncHttpxClient(
+        http2=importlib.util.find_spec('h2') is not None,
+        limits=httpx.Limits(
+            max_connections=100,
+            max_keepalive_connections=10,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        )
+    )
+)
+
+# Vision results cache, keyed by the exact image bytes (re-sent photos)
+VISION_CACHE_SIZE = 256
+
+# Larger images only add upload time and image tokens without improving extraction
+VISION_MAX_SIDE = 1024
+VISION_JPEG_QUALITY = 85
+
+# Receipt model settings. The system prompt is a fixed prefix longer than 1024 tokens,
+# so OpenAI's automatic prompt caching serves it from cache on repeated calls.
+RECEIPT_MODEL = "gpt-4o-mini"
+RECEIPT_MAX_TOKENS = 150
+RECEIPT_SYSTEM_PROMPT = """You are a receipt parser for an Israeli expense-tracking bot. You receive either a photo of a
+receipt or the raw OCR text of one, and you return exactly one JSON object describing it. Receipts
+are mostly in Hebrew, sometimes mixed with English, and are printed right-to-left, so OCR text may
+show words, numbers and punctuation in an unexpected order. Read the whole receipt before answering.
+
+Output format:
+- Return only a JSON object with exactly these keys: "company", "date", "total".
+- Every value is either a string or null. Never invent a value; use null when a field is missing,
+  unreadable, or you are not confident about it.
+- Do not add explanations, markdown, comments or any other keys.
+- Example: {"company": "סופר פארם", "date": "09/07/2024", "total": "125.90"}
+- Example with missing data: {"company": "קפה גרג", "date": null, "total": "38.00"}
+
+Company ("company"):
+- The business name (שם העסק / שם החברה) as printed on the receipt, in its original language.
+- It usually appears in the first lines of the receipt, often in larger or bold print, sometimes
+  next to a logo. It may also appear at the very bottom, near a closing line such as "תודה",
+  "תודה ולהתראות", "תודה שקניתם אצלנו" or "נשמח לראותכם שוב".
+- Prefer the trading name that customers know (for example "רמי לוי", "שופרסל", "מקדונלדס", "פז")
+  over the registered legal entity, unless only the legal entity is printed.
+- Strip legal suffixes and registration details when a cleaner trading name is present:
+  "בע"מ", "בעמ", "ח.פ.", "ע.מ.", "עוסק מורשה", "עוסק פטור", and company or VAT numbers.
+- Do not return a branch address, phone number, street name, city, website, cashier name or
+  register number as the company. Lines containing "טלפון", "טל.", "כתובת", "סניף", "קופה",
+  "קופאי", "מספר עסקה" or "מס' קבלה" are not the business name on their own.
+- Document titles are never the company: "קבלה", "חשבונית", "חשבונית מס", "חשבונית מס קבלה",
+  "העתק", "מקור", "בס"ד", "לקוח יקר", "Receipt", "Invoice", "Tax invoice".
+- If a branch name follows the brand (for example "שופרסל דיל - רמת גן"), return just the brand
+  part ("שופרסל דיל").
+
+Date ("date"):
+- The date of the purchase, formatted as DD/MM/YYYY with a four-digit year and two-digit day and
+  month (for example "05/03/2024").
+- Israeli receipts write dates day first: 05/03/24, 5.3.2024 and 05-03-2024 all mean the fifth
+  of March. Only treat a date as year-first when it clearly starts with a four-digit year, such as
+  2024-03-05.
+- Two-digit years belong to the 2000s (24 means 2024).
+- Look for labels such as "תאריך", "ת.", "תאריך עסקה", "Date". A time (for example 14:32) is often
+  printed next to the date; ignore the time.
+- Ignore dates that are clearly not the purchase date: card expiry dates (usually MM/YY near the
+  card number), warranty or return deadlines ("ניתן להחליף עד", "החזרה עד"), dates of birth,
+  and printed validity dates of coupons.
+- If the day or month is unreadable, or the only date on the receipt is ambiguous, return null.
+
+Total ("total"):
+- The final amount the customer paid, including VAT, as a plain number string with a dot as the
+  decimal separator and no currency symbol or thousands separator (for example "1234.50").
+- It is usually labelled "סה"כ", "סה״כ", "סהכ", "סך הכל", "סך הכל לתשלום", "לתשלום", "סכום לתשלום",
+  "סה"כ כולל מע"מ", "Total" or "Amount due", and is often the largest amount on the receipt.
+- Do not return subtotals before discounts, VAT lines ("מע"מ", "VAT"), amounts before VAT
+  ("סה"כ לפני מע"מ"), change given ("עודף"), cash tendered ("מזומן", "התקבל"), tips,
+  savings lines ("חסכת", "הנחה"), loyalty points ("נקודות") or per-item prices.
+- When the payment is split into instalments ("תשלומים"), return the full transaction amount,
+  not the single instalment.
+- When a discount line follows the subtotal, the total is the amount after the discount.
+- Amounts may be printed with "₪", "ש"ח", "שח" or "NIS"; drop the currency. A comma may be a
+  thousands separator (1,250.00) or, rarely, a decimal separator (125,90); normalise to a dot.
+- If the total is cut off, blurred or contradictory, return null rather than guessing.
+
+General rules:
+- OCR text may contain stray characters, broken lines, swapped digits order caused by
+  right-to-left rendering, and quotes replaced by similar symbols (״ ' ` ´). Reconstruct the
+  intended words and numbers when the meaning is unambiguous.
+- A photo may be rotated, partially cropped, or contain more than one receipt. Use the receipt
+  that is most complete and most centred in the image.
+- Credit card slips attached to a receipt may repeat the total and date; they may be used to
+  confirm the values but their terminal numbers and card digits are never the company.
+- Return the JSON object only."""
+
+# Patterns used by the text cleaning and regex fallback parser
+_RE_DIRECTIONAL = re.compile(r'[\u200e\u200f\u202a-\u202e]')
+_RE_QUOTES = re.compile(r'[°""''""''`´]')
+_RE_WS = re.compile(r'\s+')
+_RE_HEB = re.compile(r'[\u0590-\u05FF]')
+_RE_LEADING_DATE = re.compile(r'^\d{1,2}[./]\d{1,2}[./]\d{2,4}')
+_RE_LEADING_AMOUNT = re.compile(r'^\d+\.\d{2}')
+_RE_NUMERIC_LINE = re.compile(r'^[\d\s\-:]+$')
+_RE_DIGITS = re.compile(r'\d+')
+_RE_DATE_PATTERNS = [
+    re.compile(r'(\d{1,2})[./\-](\d{1,2})[./\-](\d{2,4})'),
+    re.compile(r'(\d{2,4})[./\-](\d{1,2})[./\-](\d{1,2})')
+]
+_RE_AMOUNT_PATTERNS = [
+    re.compile(r'(\d+\.\d{2})\s*₪?'),
+    re.compile(r'(\d+)\s*₪'),
+    re.compile(r'₪\s*(\d+\.\d{2})'),
+    re.compile(r'₪\s*(\d+)')
+]
+_RE_AMOUNT = re.compile(r'\d+\.\d{2}')
+
+# Header lines that are never the business name
+SKIP_WORDS = ['קבלה', 'בס"ד', 'חשבונית', 'תאריך', 'שעה', 'קופה', 'עסקה', 'WT', 'לקוח יקר']
+# Lines announcing the amount due
+TOTAL_KEYWORDS = ['סה"כ', 'סך הכל', 'לתשלום', 'סה״כ', 'סכום', 'total', 'סהכ']
+# Each keyword list is matched as one alternation so a line is scanned once, not once per keyword
+_RE_SKIP_WORDS = re.compile('|'.join(map(re.escape, SKIP_WORDS)))
+_RE_TOTAL_KEYWORDS = re.compile('|'.join(map(re.escape, TOTAL_KEYWORDS)))
+
+
+class TesseractBatcher:
+    """Collect pending OCR requests and run them through a single tesseract process.
+
+    Tesseract spends a large part of each run loading the Hebrew and English models,
+    so images arriving close together are written to a scratch directory, listed in a
+    list file and recognised in one invocation. Pages in the output are separated by a form feed.
+    """
 
-def extract_text_with_tesseract(image_path: str) -> Dict[str, any]:
-    """Extract text from image using Tesseract OCR with Hebrew and English support."""
+    def __init__(self, max_wait: float = 0.2, max_batch: int = 16):
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._pending = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='tesseract-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, image_bytes: bytes) -> Future:
+        """Queue an image for recognition and return a future resolving to its text."""
+        future = Future()
+        self._pending.put((image_bytes, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._recognize(batch)
+
+    def _recognize(self, batch):
+        try:
+            pages = self._run_tesseract([image_bytes for image_bytes, _ in batch])
+            for (_, future), page in zip(batch, pages):
+                future.set_result(page)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # One unreadable image fails the whole run; retry individually so only it fails
+            for item in batch:
+                self._recognize([item])
+
+    @staticmethod
+    def _run_tesseract(images):
+        """Recognise the given images in one tesseract run and return one page of text per image."""
+        with tempfile.TemporaryDirectory() as work_dir:
+            image_paths = []
+            for index, image_bytes in enumerate(images):
+                image_path = os.path.join(work_dir, f'{index}.jpg')
+                with open(image_path, 'wb') as image_file:
+                    image_file.write(image_bytes)
+                image_paths.append(image_path)
+
+            list_path = os.path.join(work_dir, 'images.txt')
+            with open(list_path, 'w', encoding='utf-8') as list_file:
+                list_file.write('\n'.join(image_paths) + '\n')
+
+            completed = subprocess.run(
+                [pytesseract.pytesseract.tesseract_cmd, list_path, 'stdout',
+                 '-l', 'heb+eng', '--oem', '3', '--psm', '6'],
+                capture_output=True,
+                check=True
+            )
+        pages = completed.stdout.decode('utf-8', errors='replace').split('\x0c')
+        if len(pages) < len(images):
+            raise RuntimeError(f"expected {len(images)} pages, got {len(pages)}")
+        return pages[:len(images)]
+
+
+# A pool of tesserocr engines, loaded on first OCR and kept for the process lifetime
+# so concurrent receipts are recognised in parallel; falls back to batched tesseract
+# runs when tesserocr (or its language data) is not available. The vision path never
+# runs OCR, so nothing is loaded until a receipt actually needs it.
+TESS_POOL_SIZE = max(1, (os.cpu_count() or 2) // 2)
+_TESS_POOL = None
+_TESS_BATCHER = None
+_TESS_INIT_LOCK = threading.Lock()
+
+# OCR blocks, so async callers run it on threads sized to the engine pool
+_OCR_EXECUTOR = ThreadPoolExecutor(max_workers=TESS_POOL_SIZE)
+
+
+def _init_tesseract():
+    """Create the tesserocr engine pool, or the batcher when tesserocr is unavailable."""
+    global _TESS_POOL, _TESS_BATCHER
+    with _TESS_INIT_LOCK:
+        if _TESS_POOL is not None or _TESS_BATCHER is not None:
+            return
+
+        pool = queue.Queue()
+        if PyTessBaseAPI is not None:
+            try:
+                for _ in range(TESS_POOL_SIZE):
+                    pool.put(PyTessBaseAPI(lang='heb+eng', psm=PSM.SINGLE_BLOCK, oem=OEM.DEFAULT))
+            except RuntimeError as e:
+                print(f"tesserocr init error, using tesseract binary: {str(e)}")
+
+        if pool.empty():
+            _TESS_BATCHER = TesseractBatcher()
+        else:
+            _TESS_POOL = pool
+
+
+def _recognize_text(image_bytes: bytes) -> str:
+    """Run OCR on a single image with whichever Tesseract backend is available."""
+    _init_tesseract()
+    if _TESS_BATCHER is not None:
+        return _TESS_BATCHER.submit(image_bytes).result()
+
+    image = Image.open(io.BytesIO(image_bytes))
+    # PyTessBaseAPI is not reentrant, so each call borrows its own engine
+    api = _TESS_POOL.get()
     try:
-        image = Image.open(image_path)
-        config = r'--oem 3 --psm 6'
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    finally:
+        _TESS_POOL.put(api)
 
-        text = pytesseract.image_to_string(
-            image,
-            lang='heb+eng',
-            config=config
-        )
+
+def extract_text_with_tesseract(image_bytes: bytes) -> Dict[str, any]:
+    """Extract text from image using Tesseract OCR with Hebrew and English support."""
+    try:
+        text = _recognize_text(image_bytes)
 
         return {
             'success': True,
@@ -49,40 +313,81 @@ def clean_hebrew_text(text: str) -> str:
         return text
 
     # Remove RTL/LTR marks and other directional characters
-    text = re.sub(r'[\u200e\u200f\u202a-\u202e]', '', text)
+    text = _RE_DIRECTIONAL.sub('', text)
 
     # Remove common OCR artifacts and quotes
-    text = re.sub(r'[°""''""''`´]', '', text)
+    text = _RE_QUOTES.sub('', text)
 
     # Clean up extra spaces
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = _RE_WS.sub(' ', text).strip()
 
     return text
 
 
-def extract_with_openai_vision(image_path: str) -> Dict[str, Optional[str]]:
-    """Use OpenAI Vision (GPT-4o or gpt-4-vision-preview) to extract structured data directly from image."""
-    try:
-        with open(image_path, "rb") as image_file:
-            image_bytes = image_file.read()
-            encoded_image = base64.b64encode(image_bytes).decode("utf-8")
+def vision_cache(func):
+    """Cache vision results by the SHA-256 of the exact image bytes."""
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    @wraps(func)
+    async def wrapper(image_bytes: bytes) -> Dict[str, Optional[str]]:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+
+        with lock:
+            cached = cache.get(digest)
+            if cached is not None:
+                cache.move_to_end(digest)
+                return dict(cached)
+
+        result = await func(image_bytes)
+
+        # Only successful extractions are worth remembering
+        if any(result.get(key) for key in ('company', 'date', 'total')):
+            with lock:
+                cache[digest] = dict(result)
+                cache.move_to_end(digest)
+                if len(cache) > VISION_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return result
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+def _parse_receipt_json(content: str) -> Dict[str, Optional[str]]:
+    """Pull the receipt fields out of a JSON-mode model reply."""
+    result = json.loads(content)
+    return {
+        'company': result.get('company'),
+        'date': result.get('date'),
+        'total': result.get('total')
+    }
+
 
-        prompt = """Extract the following information from this Hebrew receipt image:
-        1. Company name (שם החברה) – usually at the top or very bottom near 'תודה'.
-        2. Date – in DD/MM/YYYY format.
-        3. Total amount – the largest number near 'סה"כ', 'סך הכל', 'לתשלום'.
+def _prepare_image_for_upload(image_bytes: bytes) -> bytes:
+    """Shrink the image to the size the vision model actually reads and re-encode it as JPEG."""
+    image = Image.open(io.BytesIO(image_bytes))
+    image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, 'JPEG', quality=VISION_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
 
-        If data is missing, use null.
-        Return only valid JSON with keys: {"company": "...", "date": "...", "total": "..."}."""
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
+@vision_cache
+async def extract_with_openai_vision(image_bytes: bytes) -> Dict[str, Optional[str]]:
+    """Use OpenAI Vision (GPT-4o mini) to extract structured data directly from image bytes."""
+    try:
+        upload_bytes = await asyncio.to_thread(_prepare_image_for_upload, image_bytes)
+        encoded_image = base64.b64encode(upload_bytes).decode("utf-8")
+
+        response = await client.chat.completions.create(
+            model=RECEIPT_MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful receipt parser."},
+                {"role": "system", "content": RECEIPT_SYSTEM_PROMPT},
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": prompt},
+                        {"type": "text", "text": "Extract the company, date and total from this receipt image."},
                         {
                             "type": "image_url",
                             "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}
@@ -90,148 +395,199 @@ def extract_with_openai_vision(image_path: str) -> Dict[str, Optional[str]]:
                     ],
                 },
             ],
-            max_tokens=500,
+            max_tokens=RECEIPT_MAX_TOKENS,
+            response_format={"type": "json_object"},
         )
 
-        content = response.choices[0].message.content.strip()
-
-        # Parse JSON from the response
-        start = content.find('{')
-        end = content.rfind('}') + 1
-        if start != -1 and end != 0:
-            json_str = content[start:end]
-            result = json.loads(json_str)
-            return {
-                'company': result.get('company'),
-                'date': result.get('date'),
-                'total': result.get('total')
-            }
-        else:
-            raise ValueError("No JSON found in response.")
+        return _parse_receipt_json(response.choices[0].message.content)
 
     except Exception as e:
         print(f"OpenAI Vision error: {str(e)}")
         return {'company': None, 'date': None, 'total': None}
 
 
+async def extract_with_openai_gpt_text(text: str) -> Dict[str, Optional[str]]:
+    """Use GPT-4o mini to extract structured data from OCR text, without re-uploading the image."""
+    try:
+        prompt = f"Extract the company, date and total from this receipt OCR text:\n\n{text}"
 
-def parse_hebrew_receipt_fallback(text: str) -> Dict[str, Optional[str]]:
-    """Fallback regex-based parser for when GPT fails."""
-    text = clean_hebrew_text(text)
-    lines = [clean_hebrew_text(line.strip()) for line in text.split('\n') if line.strip()]
-    result = {'company': None, 'date': None, 'total': None}
+        response = await client.chat.completions.create(
+            model=RECEIPT_MODEL,
+            messages=[
+                {"role": "system", "content": RECEIPT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=RECEIPT_MAX_TOKENS,
+            response_format={"type": "json_object"},
+        )
 
-    # Extract Company Name
-    skip_words = ['קבלה', 'בס"ד', 'חשבונית', 'תאריך', 'שעה', 'קופה', 'עסקה', 'WT', 'לקוח יקר']
+        return _parse_receipt_json(response.choices[0].message.content)
+
+    except Exception as e:
+        print(f"OpenAI GPT error: {str(e)}")
+        return {'company': None, 'date': None, 'total': None}
+
+
+def _find_company(line: str) -> bool:
+    """Check whether a header line looks like the business name."""
+    if _RE_SKIP_WORDS.search(line):
+        return False
+
+    return bool(len(line) > 3 and
+                _RE_HEB.search(line) and
+                not _RE_LEADING_DATE.search(line) and
+                not _RE_LEADING_AMOUNT.search(line) and
+                not _RE_NUMERIC_LINE.search(line) and
+                (_RE_DIGITS.search(line) or len(line.split()) >= 2))
 
-    for line in lines[:10]:
-        if any(skip_word in line for skip_word in skip_words):
-            continue
 
-        if (len(line) > 3 and
-                re.search(r'[\u0590-\u05FF]', line) and
-                not re.search(r'^\d{1,2}[./]\d{1,2}[./]\d{2,4}', line) and
-                not re.search(r'^\d+\.\d{2}', line) and
-                not re.search(r'^[\d\s\-:]+$', line)):
+def _find_date(line: str) -> Optional[str]:
+    """Return the date found in a line, if any."""
+    date = None
+    for pattern in _RE_DATE_PATTERNS:
+        for day, month, year in pattern.findall(line):
+            if len(year) == 2:
+                year = '20' + year if int(year) < 50 else '19' + year
 
-            if (re.search(r'[\u0590-\u05FF]', line) and
-                    (re.search(r'\d+', line) or len(line.split()) >= 2)):
-                result['company'] = line
+            if 1 <= int(day) <= 31 and 1 <= int(month) <= 12:
+                date = f"{day}/{month}/{year}"
                 break
+    return date
 
-    # Extract Date
-    date_patterns = [
-        r'(\d{1,2})[./\-](\d{1,2})[./\-](\d{2,4})',
-        r'(\d{2,4})[./\-](\d{1,2})[./\-](\d{1,2})'
-    ]
 
-    for line in lines:
-        for pattern in date_patterns:
-            matches = re.findall(pattern, line)
-            for match in matches:
-                day, month, year = match
-                if len(year) == 2:
-                    year = '20' + year if int(year) < 50 else '19' + year
+def _find_amount(line: str) -> Optional[str]:
+    """Return the largest amount matched by the first amount pattern that hits the line."""
+    for pattern in _RE_AMOUNT_PATTERNS:
+        amounts = pattern.findall(line)
+        if amounts:
+            return max(amounts, key=float)
+    return None
 
-                try:
-                    if 1 <= int(day) <= 31 and 1 <= int(month) <= 12:
-                        result['date'] = f"{day}/{month}/{year}"
-                        break
-                except ValueError:
-                    continue
-        if result['date']:
-            break
 
-    # Extract Total Amount
-    total_keywords = ['סה"כ', 'סך הכל', 'לתשלום', 'סה״כ', 'סכום', 'total', 'סהכ']
+def _scan_receipt(lines: List[str]) -> Dict[str, Optional[str]]:
+    """Scan receipt lines once, collecting company, date and total together.
+
+    Each field keeps the priority of a dedicated pass: the company comes from the
+    first ten lines, the date from the first line holding a valid one, and the total
+    from the first keyword line with an amount within the next two lines, falling
+    back to the largest plausible amount on the receipt.
+    """
+    result = {'company': None, 'date': None, 'total': None}
+    all_amounts = []
 
     for i, line in enumerate(lines):
-        if any(keyword in line.lower() for keyword in total_keywords):
-            search_lines = lines[i:i + 3]
-
-            for search_line in search_lines:
-                amount_patterns = [
-                    r'(\d+\.\d{2})\s*₪?',
-                    r'(\d+)\s*₪',
-                    r'₪\s*(\d+\.\d{2})',
-                    r'₪\s*(\d+)'
-                ]
-
-                for pattern in amount_patterns:
-                    amounts = re.findall(pattern, search_line)
-                    if amounts:
-                        result['total'] = max(amounts, key=lambda x: float(x))
+        if result['company'] is None and i < 10 and _find_company(line):
+            result['company'] = line
+
+        if result['date'] is None:
+            result['date'] = _find_date(line)
+
+        if result['total'] is None:
+            if _RE_TOTAL_KEYWORDS.search(line.lower()):
+                for search_line in lines[i:i + 3]:
+                    result['total'] = _find_amount(search_line)
+                    if result['total']:
                         break
 
-                if result['total']:
-                    break
+            for amount in _RE_AMOUNT.findall(line):
+                value = float(amount)
+                if 1.0 <= value <= 10000.0:
+                    all_amounts.append((value, amount))
 
-        if result['total']:
+        if None not in result.values():
             break
 
     # Fallback: Find largest amount
-    if not result['total']:
-        all_amounts = []
-        for line in lines:
-            amounts = re.findall(r'\d+\.\d{2}', line)
-            for amount in amounts:
-                if 1.0 <= float(amount) <= 10000.0:
-                    all_amounts.append(amount)
-
-        if all_amounts:
-            result['total'] = max(all_amounts, key=lambda x: float(x))
+    if not result['total'] and all_amounts:
+        result['total'] = max(all_amounts, key=itemgetter(0))[1]
 
     return result
 
 
-def process_receipt(image_path: str, use_gpt: bool = True, use_vision: bool = True) -> Dict[str, any]:
-    """
-    Process receipt image using either OpenAI Vision or Tesseract + GPT fallback.
-    """
-    if not os.path.exists(image_path):
-        return {"error": "Image file not found"}
+def parse_hebrew_receipt_fallback(text: str) -> Dict[str, Optional[str]]:
+    """Fallback regex-based parser for when GPT fails."""
+    text = clean_hebrew_text(text)
+    lines = [clean_hebrew_text(line.strip()) for line in text.split('\n') if line.strip()]
+    return _scan_receipt(lines)
 
-    if use_gpt and use_vision:
-        receipt_data = extract_with_openai_vision(image_path)
-        receipt_data['extraction_method'] = 'OpenAI Vision API'
-        receipt_data['raw_text'] = None  # not used
-        return receipt_data
 
-    # Fallback to OCR + GPT/regex
-    ocr_result = extract_text_with_tesseract(image_path)
+async def _ocr_in_executor(image_bytes: bytes) -> Dict[str, any]:
+    """Run Tesseract on the OCR executor so the event loop stays free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_OCR_EXECUTOR, extract_text_with_tesseract, image_bytes)
+
+
+async def _extract_vision_only(image_bytes: bytes) -> Dict[str, any]:
+    """Read the receipt straight from the image; no OCR pass is needed."""
+    receipt_data = await extract_with_openai_vision(image_bytes)
+    receipt_data['extraction_method'] = 'OpenAI Vision API'
+    receipt_data['raw_text'] = None  # not used
+    return receipt_data
+
+
+async def _extract_tesseract_gpt(image_bytes: bytes) -> Dict[str, any]:
+    """OCR the receipt locally and let GPT structure the text."""
+    ocr_result = await _ocr_in_executor(image_bytes)
     if not ocr_result['success']:
         return {"error": ocr_result['error']}
 
-    if use_gpt:
-        receipt_data = extract_with_openai_vision(ocr_result['text'])
-    else:
-        receipt_data = parse_hebrew_receipt_fallback(ocr_result['text'])
+    receipt_data = await extract_with_openai_gpt_text(ocr_result['text'])
+    receipt_data['raw_text'] = ocr_result['text']
+    receipt_data['extraction_method'] = 'GPT-4o mini'
+    return receipt_data
 
+
+async def _extract_tesseract_regex(image_bytes: bytes) -> Dict[str, any]:
+    """OCR the receipt locally and parse it with the regex fallback."""
+    ocr_result = await _ocr_in_executor(image_bytes)
+    if not ocr_result['success']:
+        return {"error": ocr_result['error']}
+
+    receipt_data = parse_hebrew_receipt_fallback(ocr_result['text'])
     receipt_data['raw_text'] = ocr_result['text']
-    receipt_data['extraction_method'] = 'GPT-3.5' if use_gpt else 'Regex'
+    receipt_data['extraction_method'] = 'Regex'
     return receipt_data
 
 
+# Extraction strategy by (use_gpt, use_vision); vision is only meaningful with GPT
+_EXTRACTION_STRATEGIES = {
+    (True, True): _extract_vision_only,
+    (True, False): _extract_tesseract_gpt,
+    (False, True): _extract_tesseract_regex,
+    (False, False): _extract_tesseract_regex,
+}
+
+
+async def process_receipt_async(image_bytes: bytes, use_gpt: bool = True, use_vision: bool = True) -> Dict[str, any]:
+    """
+    Process receipt image bytes using either OpenAI Vision or Tesseract + GPT fallback, without blocking the event loop.
+    """
+    if not image_bytes:
+        return {"error": "Image is empty"}
+
+    strategy = _EXTRACTION_STRATEGIES[(bool(use_gpt), bool(use_vision))]
+    return await strategy(image_bytes)
+
+
+async def warmup():
+    """Open the OpenAI connection before the first receipt arrives."""
+    try:
+        await client.models.list()
+    except Exception as e:
+        print(f"OpenAI warmup error: {str(e)}")
+
+
+def process_receipt(image_path: str, use_gpt: bool = True, use_vision: bool = True) -> Dict[str, any]:
+    """
+    Process receipt image using either OpenAI Vision or Tesseract + GPT fallback.
+    """
+    if not os.path.exists(image_path):
+        return {"error": "Image file not found"}
+
+    with open(image_path, "rb") as image_file:
+        image_bytes = image_file.read()
+    return asyncio.run(process_receipt_async(image_bytes, use_gpt, use_vision))
+
 
 def save_results(image_path: str, receipt_data: Dict[str, any]) -> str:
     """Save results to JSON file."""
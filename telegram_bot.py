@@ -1,14 +1,16 @@
+import asyncio
 import logging
-import tempfile
 import os
+import threading
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from datetime import datetime
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.pool
+from psycopg2.extras import RealDictCursor, execute_values
 import re
 
-from receipt_ocr import process_receipt
+from receipt_ocr import process_receipt_async, warmup as warmup_receipt_ocr
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -29,67 +31,150 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'telegramdb')
 }
 
+# Anything that is not part of a number
+_RE_NON_NUMERIC = re.compile(r'[^\d.,]')
+# DD/MM/YYYY style dates (any of / . - as separator, 2 or 4 digit year) or ISO YYYY-MM-DD
+_RE_DATE = re.compile(
+    r'(?P<day>\d{1,2})(?P<sep>[./-])(?P<month>\d{1,2})(?P=sep)(?P<year>\d{4}|\d{2})'
+    r'|(?P<iso_year>\d{4})-(?P<iso_month>\d{1,2})-(?P<iso_day>\d{1,2})'
+)
+
+
+# Prompts asking the user for a field the receipt was missing
+MISSING_DATA_PROMPTS = {
+    'company': "🏢 **אנא הכנס את שם העסק/החברה:**\n(לדוגמה: סופר פארם, מקדונלדס, רמי לוי)",
+    'price': "💰 **אנא הכנס את הסכום:**\n(לדוגמה: 25.50, 100, 15.99)",
+    'date': "📅 **אנא הכנס את התאריך:**\n(לדוגמה: 09/07/2024, 9.7.24, היום)"
+}
+DEFAULT_MISSING_DATA_PROMPT = "אנא הכנס את המידע החסר:"
+
+# Replies to invalid input for a missing field
+INPUT_ERROR_MESSAGES = {
+    'company': "❌ שם העסק צריך להכיל לפחות 2 תווים. נסה שוב:",
+    'price': "❌ הסכום לא תקין. הכנס מספר (לדוגמה: 25.50). נסה שוב:",
+    'date': "❌ התאריך לא תקין. השתמש בפורמט כמו 09/07/2024 או כתוב 'היום'. נסה שוב:"
+}
+DEFAULT_INPUT_ERROR_MESSAGE = "❌ קלט לא תקין. נסה שוב:"
+
+# Display names of receipt fields
+FIELD_DISPLAY_NAMES = {
+    'company': 'עסק',
+    'price': 'סכום',
+    'date': 'תאריך'
+}
+
+# Number of payments listed by /payments; totals always cover the full history
+RECENT_PAYMENTS_LIMIT = 10
+
+# Shared connection pool, opened on first use; handlers reach it from worker threads
+DB_POOL = None
+_DB_POOL_LOCK = threading.Lock()
+
 
 # Database connection function
 def get_db_connection():
-    """Create and return a database connection."""
+    """Borrow a database connection from the pool, creating the pool on first use."""
+    global DB_POOL
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
+        if DB_POOL is None:
+            with _DB_POOL_LOCK:
+                if DB_POOL is None:
+                    DB_POOL = psycopg2.pool.ThreadedConnectionPool(minconn=2, maxconn=10, **DB_CONFIG)
+        return DB_POOL.getconn()
     except psycopg2.Error as e:
         logger.error(f"Database connection error: {e}")
         return None
 
 
+def release_db(conn):
+    """Return a borrowed connection to the pool, discarding it if it has been closed."""
+    DB_POOL.putconn(conn, close=bool(conn.closed))
+
+
+def run_db_query(operation, error_message, default=None):
+    """Run operation(conn) on a pooled connection and commit, returning default on failure.
+
+    A pooled connection can be dropped while idle (e.g. an RDS idle timeout); the
+    first query on it then fails and closes it. Such a connection is discarded and
+    the operation retried once on a fresh one.
+    """
+    for attempt in range(2):
+        conn = get_db_connection()
+        if not conn:
+            return default
+
+        try:
+            result = operation(conn)
+            conn.commit()
+            return result
+        except psycopg2.Error as e:
+            if conn.closed:
+                if attempt == 0 and isinstance(e, psycopg2.OperationalError):
+                    logger.warning(f"Database connection lost, retrying: {e}")
+                    continue
+            else:
+                conn.rollback()
+            logger.error(f"{error_message}: {e}")
+            return default
+        finally:
+            release_db(conn)
+
+    return default
+
+
+def insert_payments_bulk(rows):
+    """Insert several (user_id, company, date, price) rows in one round-trip and return their IDs."""
+    insert_query = """
+    INSERT INTO payments (user_id, company, date, price)
+    VALUES %s
+    RETURNING id;
+    """
+    rows = [(str(user_id), company, date, price) for user_id, company, date, price in rows]
+
+    def insert(conn):
+        with conn.cursor() as cursor:
+            return [row[0] for row in execute_values(cursor, insert_query, rows, page_size=100, fetch=True)]
+
+    payment_ids = run_db_query(insert, "Error inserting payments")
+    if payment_ids is not None:
+        logger.info(f"Payments inserted successfully with IDs: {payment_ids}")
+    return payment_ids
+
+
 def insert_payment(user_id, company, date, price):
     """Insert a payment record into the database."""
-    conn = get_db_connection()
-    if not conn:
-        return False
+    return insert_payments_bulk([(user_id, company, date, price)]) is not None
 
-    try:
-        cursor = conn.cursor()
-        insert_query = """
-        INSERT INTO payments (user_id, company, date, price)
-        VALUES (%s, %s, %s, %s)
-        RETURNING id;
-        """
-        cursor.execute(insert_query, (str(user_id), company, date, price))
-        payment_id = cursor.fetchone()[0]
-        conn.commit()
-        logger.info(f"Payment inserted successfully with ID: {payment_id}")
-        return True
-    except psycopg2.Error as e:
-        logger.error(f"Error inserting payment: {e}")
-        conn.rollback()
-        return False
-    finally:
-        cursor.close()
-        conn.close()
 
+def get_user_payments_summary(user_id):
+    """Get the number of payments and the total spent for a specific user, or None on error."""
+    def fetch_summary(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(price), 0)
+                FROM payments 
+                WHERE user_id = %s
+            """, (str(user_id),))
+            payments_count, total_spent = cursor.fetchone()
+            return payments_count, float(total_spent)
 
-def get_user_payments(user_id):
-    """Get all payments for a specific user."""
-    conn = get_db_connection()
-    if not conn:
-        return []
+    return run_db_query(fetch_summary, "Error fetching user payments summary")
 
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT id, company, date, price 
-            FROM payments 
-            WHERE user_id = %s 
-            ORDER BY date DESC
-        """, (str(user_id),))
-        payments = cursor.fetchall()
-        return payments
-    except psycopg2.Error as e:
-        logger.error(f"Error fetching user payments: {e}")
-        return []
-    finally:
-        cursor.close()
-        conn.close()
+
+def get_user_payments(user_id, limit=RECENT_PAYMENTS_LIMIT):
+    """Get the most recent payments for a specific user."""
+    def fetch_payments(conn):
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT id, company, date, price 
+                FROM payments 
+                WHERE user_id = %s 
+                ORDER BY date DESC, id DESC
+                LIMIT %s
+            """, (str(user_id), limit))
+            return cursor.fetchall()
+
+    return run_db_query(fetch_payments, "Error fetching user payments", [])
 
 
 def parse_price(price_str):
@@ -98,7 +183,7 @@ def parse_price(price_str):
         return None
 
     # Remove currency symbols and extract numbers
-    price_clean = re.sub(r'[^\d.,]', '', str(price_str))
+    price_clean = _RE_NON_NUMERIC.sub('', str(price_str))
     if not price_clean:
         return None
 
@@ -121,36 +206,26 @@ def parse_date(date_str):
     if not date_str or date_str == 'לא נמצא':
         return datetime.now().date()
 
-    # Common date formats
-    date_formats = [
-        '%d/%m/%Y',
-        '%d.%m.%Y',
-        '%d-%m-%Y',
-        '%Y-%m-%d',
-        '%d/%m/%y',
-        '%d.%m.%y'
-    ]
-
-    for fmt in date_formats:
+    match = _RE_DATE.fullmatch(date_str)
+    if match:
+        if match.group('year'):
+            day, month, year = match.group('day', 'month', 'year')
+        else:
+            year, month, day = match.group('iso_year', 'iso_month', 'iso_day')
+
+        if len(year) == 2:
+            # Same pivot as strptime's %y
+            year = int(year) + (2000 if int(year) < 69 else 1900)
+
         try:
-            return datetime.strptime(date_str, fmt).date()
+            return datetime(int(year), int(month), int(day)).date()
         except ValueError:
-            continue
+            pass
 
     # If no format matches, return today's date
     return datetime.now().date()
 
 
-def get_missing_data_text(missing_field):
-    """Get the prompt text for missing data."""
-    prompts = {
-        'company': "🏢 **אנא הכנס את שם העסק/החברה:**\n(לדוגמה: סופר פארם, מקדונלדס, רמי לוי)",
-        'price': "💰 **אנא הכנס את הסכום:**\n(לדוגמה: 25.50, 100, 15.99)",
-        'date': "📅 **אנא הכנס את התאריך:**\n(לדוגמה: 09/07/2024, 9.7.24, היום)"
-    }
-    return prompts.get(missing_field, "אנא הכנס את המידע החסר:")
-
-
 def validate_and_parse_input(field_type, user_input):
     """Validate and parse user input for missing fields."""
     if field_type == 'company':
@@ -191,12 +266,7 @@ async def process_missing_data_input(update: Update, context: ContextTypes.DEFAU
     parsed_value, is_valid = validate_and_parse_input(waiting_for, user_input)
 
     if not is_valid:
-        error_messages = {
-            'company': "❌ שם העסק צריך להכיל לפחות 2 תווים. נסה שוב:",
-            'price': "❌ הסכום לא תקין. הכנס מספר (לדוגמה: 25.50). נסה שוב:",
-            'date': "❌ התאריך לא תקין. השתמש בפורמט כמו 09/07/2024 או כתוב 'היום'. נסה שוב:"
-        }
-        await update.message.reply_text(error_messages.get(waiting_for, "❌ קלט לא תקין. נסה שוב:"))
+        await update.message.reply_text(INPUT_ERROR_MESSAGES.get(waiting_for, DEFAULT_INPUT_ERROR_MESSAGE))
         return True
 
     # Update the pending receipt data
@@ -218,14 +288,15 @@ async def process_missing_data_input(update: Update, context: ContextTypes.DEFAU
         context.user_data['waiting_for'] = next_missing
 
         # Confirm current input and ask for next
-        confirm_text = f"✅ {get_field_display_name(waiting_for)}: {get_display_value(waiting_for, parsed_value)}\n\n"
-        missing_text = get_missing_data_text(next_missing)
+        confirm_text = f"✅ {FIELD_DISPLAY_NAMES.get(waiting_for, waiting_for)}: {get_display_value(waiting_for, parsed_value)}\n\n"
+        missing_text = MISSING_DATA_PROMPTS.get(next_missing, DEFAULT_MISSING_DATA_PROMPT)
 
         await update.message.reply_text(f"{confirm_text}{missing_text}")
     else:
         # All data collected, save to database
         receipt = pending_receipt
-        success = insert_payment(
+        success = await asyncio.to_thread(
+            insert_payment,
             receipt['user_id'],
             receipt['company'],
             receipt['parsed_date'],
@@ -254,16 +325,6 @@ async def process_missing_data_input(update: Update, context: ContextTypes.DEFAU
     return True
 
 
-def get_field_display_name(field_type):
-    """Get display name for field type."""
-    names = {
-        'company': 'עסק',
-        'price': 'סכום',
-        'date': 'תאריך'
-    }
-    return names.get(field_type, field_type)
-
-
 def get_display_value(field_type, value):
     """Get formatted display value for field."""
     if field_type == 'price':
@@ -274,28 +335,6 @@ def get_display_value(field_type, value):
         return str(value)
     else:
         return str(value)
-    """Parse date string to datetime.date object."""
-    if not date_str or date_str == 'לא נמצא':
-        return datetime.now().date()
-
-    # Common date formats
-    date_formats = [
-        '%d/%m/%Y',
-        '%d.%m.%Y',
-        '%d-%m-%Y',
-        '%Y-%m-%d',
-        '%d/%m/%y',
-        '%d.%m.%y'
-    ]
-
-    for fmt in date_formats:
-        try:
-            return datetime.strptime(date_str, fmt).date()
-        except ValueError:
-            continue
-
-    # If no format matches, return today's date
-    return datetime.now().date()
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -339,43 +378,35 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def show_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show all payments for the user."""
+    """Show the user's payment count and total, and their most recent payments."""
     user_id = update.message.from_user.id
-    payments = get_user_payments(user_id)
+    summary = await asyncio.to_thread(get_user_payments_summary, user_id)
+
+    if summary is None:
+        await update.message.reply_text("⚠️ שגיאה בטעינת התשלומים. נסה שוב מאוחר יותר.")
+        return
 
-    if not payments:
+    payments_count, total_spent = summary
+    if not payments_count:
         await update.message.reply_text("🔍 לא נמצאו תשלומים עבורך עדיין.\nשלח תמונה של קבלה כדי להתחיל!")
         return
 
-    response = f"📊 **התשלומים שלך ({len(payments)} סה\"כ):**\n\n"
+    payments = await asyncio.to_thread(get_user_payments, user_id)
+
+    response = f"📊 **התשלומים שלך ({payments_count} סה\"כ):**\n\n"
+    if payments_count > len(payments):
+        response += f"📋 **{len(payments)} התשלומים האחרונים:**\n\n"
 
-    total_spent = 0
     for payment in payments:
         date_str = payment['date'].strftime('%d/%m/%Y')
         price = float(payment['price'])
-        total_spent += price
 
         response += f"🏢 **{payment['company']}**\n"
         response += f"📅 {date_str} | 💰 {price:.2f} ₪\n\n"
 
     response += f"💳 **סה\"כ הוצאות:** {total_spent:.2f} ₪"
 
-    # Split message if too long
-    if len(response) > 4000:
-        await update.message.reply_text(
-            f"📊 **סיכום התשלומים:**\n💳 סה\"כ הוצאות: {total_spent:.2f} ₪\n📈 מספר תשלומים: {len(payments)}")
-
-        # Send recent payments
-        recent_payments = payments[:10]  # Show last 10
-        recent_response = f"📋 **10 התשלומים האחרונים:**\n\n"
-        for payment in recent_payments:
-            date_str = payment['date'].strftime('%d/%m/%Y')
-            price = float(payment['price'])
-            recent_response += f"🏢 {payment['company']} | 📅 {date_str} | 💰 {price:.2f} ₪\n"
-
-        await update.message.reply_text(recent_response)
-    else:
-        await update.message.reply_text(response, parse_mode='Markdown')
+    await update.message.reply_text(response, parse_mode='Markdown')
 
 
 async def process_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -387,18 +418,20 @@ async def process_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Get the largest photo
         photo_file = await update.message.photo[-1].get_file()
 
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_path = tmp_file.name
-
-        # Download the photo
-        await photo_file.download_to_drive(tmp_path)
+        # Download the photo straight into memory
+        image_bytes = bytes(await photo_file.download_as_bytearray())
 
-        # Process the receipt
-        result = process_receipt(tmp_path)
-
-        # Delete temporary file
-        os.unlink(tmp_path)
+        # Process the receipt while letting the user know it was received;
+        # the status edit is cosmetic, so a failure there is only logged
+        result, status_edit = await asyncio.gather(
+            process_receipt_async(image_bytes),
+            processing_msg.edit_text("⏳ מזהה את פרטי הקבלה..."),
+            return_exceptions=True
+        )
+        if isinstance(status_edit, Exception):
+            logger.warning(f"Could not update processing message: {status_edit}")
+        if isinstance(result, Exception):
+            raise result
 
         # Format response
         if "error" in result:
@@ -450,14 +483,14 @@ async def process_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 response += f"💰 **סכום:** {total_display}\n\n"
 
                 # Ask for missing data
-                missing_text = get_missing_data_text(missing_data[0])
+                missing_text = MISSING_DATA_PROMPTS.get(missing_data[0], DEFAULT_MISSING_DATA_PROMPT)
                 response += f"⚠️ **חסר מידע!**\n{missing_text}"
 
                 context.user_data['waiting_for'] = missing_data[0]
                 await processing_msg.edit_text(response, parse_mode='Markdown')
             else:
                 # All data found, save directly
-                if insert_payment(user_id, company, parsed_date, parsed_price):
+                if await asyncio.to_thread(insert_payment, user_id, company, parsed_date, parsed_price):
                     db_status = "\n✅ **הנתונים נשמרו בהצלחה!**"
                 else:
                     db_status = "\n⚠️ **שגיאה בשמירת הנתונים**"
@@ -538,17 +571,28 @@ async def handle_non_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("לא הבנתי... נסה לשלוח קבלה 📷 או כתוב /help לעזרה.")
 
 
+async def _warmup(application: Application):
+    """Open the OpenAI and database connections before polling starts."""
+    await warmup_receipt_ocr()
+
+    # Fill the connection pool with its minimum connections
+    conn = get_db_connection()
+    if conn:
+        release_db(conn)
+
+
 def main():
     """Start the bot."""
     # Create the Application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_init(_warmup).build()
 
     # Register handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("payments", show_payments))
     application.add_handler(CommandHandler("raw", show_raw_text))
-    application.add_handler(MessageHandler(filters.PHOTO, process_image))
+    # Receipts are processed concurrently so one user's photo doesn't hold up everyone else
+    application.add_handler(MessageHandler(filters.PHOTO, process_image, block=False))
     application.add_handler(MessageHandler(~filters.PHOTO & ~filters.COMMAND, handle_non_photo))
 
     # Run the bot